@@ -1,18 +1,61 @@
 import os
+import re
+import sys
+import stat
+import time
+import io
+import mmap
+import gzip
+import html
+import json
+import shutil
+import tarfile
+import zipfile
 import asyncio
 import logging
+import cProfile
+import pstats
+import tempfile
+import threading
+import contextvars
+import multiprocessing
+import logging.handlers
+from uuid import uuid4
+from functools import lru_cache, partial
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from telegram import Update, InputMediaPhoto, InputMediaDocument, ChatMemberAdministrator
+from telegram import Update, InputFile, InputMedia, InputMediaPhoto, InputMediaDocument, ChatMemberAdministrator
 from telegram.constants import ParseMode
 from telegram.ext import Application, CommandHandler, ContextTypes
 from telegram.error import NetworkError, TimedOut, RetryAfter, BadRequest, Forbidden
 
+# Optional: near-duplicate image filter (/dedup) needs numpy and Pillow
+try:
+    import numpy as np
+    from PIL import Image
+    NEAR_DUP_AVAILABLE = True
+except ImportError:
+    np = None
+    Image = None
+    NEAR_DUP_AVAILABLE = False
+
+# Optional: .tar.zst uploads need zstandard (tarfile only reads gz/bz2/xz natively)
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 # Configuration
 BOT_TOKEN = "YOUR_BOT_TOKEN_HERE"
 IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.tiff', '.webp', '.svg'}
 MAX_FILE_SIZE = 50 * 1024 * 1024  # 50 MB
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz', '.tar.zst', '.tzst')
 LOGGING_ENABLED = True
 LOG_FILE_PATH = "bot_upload_logs.txt"
+LOG_MAX_BYTES = 10 * 1024 * 1024  # Rotate into a gzip'd segment at 10 MB
+LOG_BACKUP_COUNT = 30  # Compressed segments kept on disk
+LOG_INDEX_PATH = "bot_upload_logs.index.json"  # Time span of every segment, used by /exportlog
 
 # Reliability settings
 MAX_RETRIES = 3
@@ -20,8 +63,132 @@ INITIAL_RETRY_DELAY = 2  # seconds
 TIMEOUT_SECONDS = 300  # 5 minutes for large files
 RATE_LIMIT_DELAY = 1.0  # Base delay between requests
 
+# Scan filter settings (.gitignore-style rules applied to every upload, before per-chat and per-call rules)
+# Examples: ".git/", "node_modules/", "*.tmp", "!keep.tmp", "re:\\.bak$", "size>50M", "mtime>30d"
+# mtime with an age (30d, 12h) compares the file's age (mtime>30d = older than 30 days); with a date it compares the date
+DEFAULT_FILTER_RULES = []
+
+# Near-duplicate image settings (/dedup on|off [similarity])
+NEAR_DUP_HASH = 'dhash'  # 'dhash' (gradient, fastest) or 'phash' (DCT, more robust to re-encoding)
+NEAR_DUP_SIMILARITY = 90  # Default % of matching hash bits to treat an image as a near-duplicate
+NEAR_DUP_WORKERS = None  # Hashing processes (None = CPU count)
+NEAR_DUP_CHUNK_SIZE = 16  # Images per worker round-trip
+NEAR_DUP_WINDOW_BYTES = 64 * 1024 * 1024  # Archive member bytes held in memory at once while hashing
+
+# Webhook mode (embedded HTTP server instead of long polling)
+WEBHOOK_ENABLED = False
+WEBHOOK_LISTEN = "0.0.0.0"
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = "/telegram"
+WEBHOOK_SECRET_TOKEN = ""  # Required: compared with the X-Telegram-Bot-Api-Secret-Token header (1-256 of A-Z a-z 0-9 _ -)
+WEBHOOK_URL = ""  # Required: public https URL registered with setWebhook (e.g. https://bot.example.com/telegram)
+WEBHOOK_TLS_CERT = ""  # PEM certificate to serve HTTPS directly (empty = plain HTTP behind a TLS proxy)
+WEBHOOK_TLS_KEY = ""  # PEM private key for WEBHOOK_TLS_CERT
+
+# Profiling settings (/profile on|off or /upload ... --profile)
+PROFILE_SAMPLE_INTERVAL = 0.005  # Stack sampling period in seconds
+PROFILE_SLOW_CALLBACK = 0.1  # Event loop stalls longer than this (seconds) are reported
+PROFILE_ASYNCIO_DEBUG = False  # Also enable asyncio debug mode to name slow callbacks (adds overhead)
+
 logger = None
 upload_stats = {'total': 0, 'success': 0, 'failed': 0, 'skipped': 0}
+current_job_id = contextvars.ContextVar('current_job_id', default='-')
+
+LOG_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+LOG_LINE_RE = re.compile(r'^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}) \| (\w+) \| (?:(\S+) \| )?')
+
+class JobIdFilter(logging.Filter):
+    """Stamp every record with the id of the upload job that produced it"""
+
+    def filter(self, record):
+        record.job_id = current_job_id.get()
+        return True
+
+def load_log_index():
+    """Load the segment index ([{'file', 'start', 'end'}], oldest first)"""
+    try:
+        with open(LOG_INDEX_PATH, 'r', encoding='utf-8') as index_file:
+            return json.load(index_file)
+    except (OSError, ValueError):
+        return []
+
+def save_log_index(index):
+    """Atomically replace the segment index"""
+    tmp_path = f"{LOG_INDEX_PATH}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as index_file:
+        json.dump(index, index_file, indent=1)
+    os.replace(tmp_path, LOG_INDEX_PATH)
+
+def _log_time_span(path):
+    """Return the (first, last) record timestamps of a plain-text log file"""
+    first = last = None
+    with open(path, 'rb') as log_file:
+        match = LOG_LINE_RE.match(log_file.readline().decode('utf-8', 'replace'))
+        if match:
+            first = match.group(1)
+        log_file.seek(max(0, os.path.getsize(path) - 64 * 1024))
+        for line in log_file.read().decode('utf-8', 'replace').splitlines():
+            match = LOG_LINE_RE.match(line)
+            if match:
+                last = match.group(1)
+    return first, last
+
+_log_index_lock = threading.Lock()
+
+def _compress_log_segment(pending_path):
+    """Gzip a rotated plain-text segment and point its index entry at the .gz file (runs in a thread)"""
+    segment_path = f"{pending_path}.gz"
+    with open(pending_path, 'rb') as src, gzip.open(segment_path, 'wb') as dst:
+        shutil.copyfileobj(src, dst, 1024 * 1024)
+    
+    with _log_index_lock:
+        index = load_log_index()
+        entry = next((e for e in index if e['file'] == pending_path), None)
+        if entry:
+            entry['file'] = segment_path
+            save_log_index(index)
+    
+    # Entries pruned while compressing leave nothing behind
+    for path in ([pending_path] if entry else [pending_path, segment_path]):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+class CompressedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """Size-based rotation into timestamped gzip segments recorded in LOG_INDEX_PATH"""
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        
+        if os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) > 0:
+            start, end = _log_time_span(self.baseFilename)
+            stem = os.path.splitext(self.baseFilename)[0]
+            pending_path = f"{stem}.{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.txt"
+            
+            # Only a rename happens on the logging call; gzip runs in the background and
+            # /exportlog reads the plain .txt segment until it is swapped for the .gz
+            os.replace(self.baseFilename, pending_path)
+            
+            with _log_index_lock:
+                index = load_log_index()
+                index.append({'file': pending_path, 'start': start, 'end': end})
+                while self.backupCount > 0 and len(index) > self.backupCount:
+                    expired = index.pop(0)
+                    try:
+                        os.remove(expired['file'])
+                    except OSError:
+                        pass
+                save_log_index(index)
+            
+            threading.Thread(
+                target=_compress_log_segment, args=(pending_path,), name="log-compressor", daemon=True
+            ).start()
+        
+        if not self.delay:
+            self.stream = self._open()
 
 def setup_logger():
     """Initialize logger with file and console output"""
@@ -29,10 +196,12 @@ def setup_logger():
     logger = logging.getLogger("telegram_uploader")
     logger.setLevel(logging.INFO)
     logger.handlers.clear()
+    logger.filters.clear()
+    logger.addFilter(JobIdFilter())
     
     formatter = logging.Formatter(
-        '%(asctime)s | %(levelname)s | %(message)s',
-        datefmt='%Y-%m-%d %H:%M:%S'
+        '%(asctime)s | %(levelname)s | %(job_id)s | %(message)s',
+        datefmt=LOG_TIME_FORMAT
     )
     
     console_handler = logging.StreamHandler()
@@ -40,7 +209,9 @@ def setup_logger():
     logger.addHandler(console_handler)
     
     if LOGGING_ENABLED:
-        file_handler = logging.FileHandler(LOG_FILE_PATH, mode='a', encoding='utf-8')
+        file_handler = CompressedRotatingFileHandler(
+            LOG_FILE_PATH, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8'
+        )
         file_handler.setFormatter(formatter)
         logger.addHandler(file_handler)
     
@@ -77,12 +248,22 @@ def update_stats(action):
     upload_stats[action] += 1
     upload_stats['total'] += 1
 
+def rewind_upload_inputs(kwargs):
+    """Seek every streamed upload back to offset 0 so each attempt sends the whole body"""
+    for value in kwargs.values():
+        for item in (value if isinstance(value, (list, tuple)) else [value]):
+            if isinstance(item, InputMedia):
+                item = item.media
+            if isinstance(item, InputFile) and hasattr(item.input_file_content, 'seek'):
+                item.input_file_content.seek(0)
+
 async def retry_with_backoff(func, *args, **kwargs):
     """Retry function with exponential backoff"""
     last_exception = None
     
     for attempt in range(MAX_RETRIES):
         try:
+            rewind_upload_inputs(kwargs)
             return await func(*args, **kwargs)
         except RetryAfter as e:
             wait_time = e.retry_after + 2
@@ -99,11 +280,805 @@ async def retry_with_backoff(func, *args, **kwargs):
     
     raise last_exception
 
+FilterRule = namedtuple('FilterRule', ['text', 'negated', 'target', 'test'])
+
+_SIZE_UNITS = {'': 1, 'B': 1, 'K': 1024, 'KB': 1024, 'M': 1024 ** 2, 'MB': 1024 ** 2, 'G': 1024 ** 3, 'GB': 1024 ** 3}
+_AGE_UNITS = {'m': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+_COMPARE_OPS = {
+    '<': lambda a, b: a < b,
+    '<=': lambda a, b: a <= b,
+    '>': lambda a, b: a > b,
+    '>=': lambda a, b: a >= b,
+}
+_RANGE_RULE_RE = re.compile(r'^(size|mtime)\s*(<=|>=|<|>)\s*(\S+)$', re.IGNORECASE)
+
+def _glob_to_regex(pattern):
+    """Translate a .gitignore-style glob into a regex body ('*' stops at '/', '**' crosses it)"""
+    out = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == '*':
+            if pattern.startswith('**/', i):
+                out.append('(?:.*/)?')
+                i += 3
+                continue
+            if pattern.startswith('**', i):
+                out.append('.*')
+                i += 2
+                continue
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            end = pattern.find(']', i + 2)
+            if end == -1:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end]
+                if '[:' in body:
+                    raise ValueError(f"POSIX character classes are not supported: {pattern[i:end + 1]}")
+                body = body.replace('\\', '\\\\').replace('[', '\\[')
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                elif body.startswith('^'):
+                    body = '\\' + body
+                out.append(f'[{body}]')
+                i = end + 1
+                continue
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return ''.join(out)
+
+def _parse_time_bound(value):
+    """Resolve a time bound to a timestamp: a date (YYYY-MM-DD[THH:MM]) or an age like 30d/12h"""
+    match = re.fullmatch(r'(\d+)([mhdw])', value)
+    if match:
+        return time.time() - int(match.group(1)) * _AGE_UNITS[match.group(2)]
+    for fmt in ('%Y-%m-%d', '%Y-%m-%dT%H:%M', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return datetime.strptime(value, fmt).timestamp()
+        except ValueError:
+            continue
+    raise ValueError(f"Invalid time value: {value}")
+
+def _compile_filter_rule(line):
+    """Compile one filter rule line into a FilterRule (None for blanks/comments)"""
+    text = line.strip()
+    if not text or text.startswith('#'):
+        return None
+
+    negated = text.startswith('!')
+    body = text[1:].strip() if negated else text
+    if not body:
+        raise ValueError(f"Empty filter rule: {text}")
+
+    if body.startswith('re:'):
+        try:
+            regex = re.compile(body[3:])
+        except re.error as e:
+            raise ValueError(f"Invalid regex in rule '{text}': {e}")
+        return FilterRule(text, negated, 'any', lambda path, size, mtime: regex.search(path) is not None)
+
+    match = _RANGE_RULE_RE.match(body)
+    if match:
+        field, op, value = match.group(1).lower(), match.group(2), match.group(3)
+        compare = _COMPARE_OPS[op]
+        if field == 'size':
+            size_match = re.fullmatch(r'(\d+(?:\.\d+)?)([KMG]?B?)', value.upper())
+            if not size_match:
+                raise ValueError(f"Invalid size value in rule '{text}'")
+            limit = float(size_match.group(1)) * _SIZE_UNITS[size_match.group(2)]
+            return FilterRule(text, negated, 'file', lambda path, size, mtime: size is not None and compare(size, limit))
+        age_match = re.fullmatch(r'(\d+)([mhdw])', value)
+        if age_match:
+            # Ages read naturally: mtime<30d means modified within the last 30 days
+            now = time.time()
+            max_age = int(age_match.group(1)) * _AGE_UNITS[age_match.group(2)]
+            return FilterRule(text, negated, 'file', lambda path, size, mtime: mtime is not None and compare(now - mtime, max_age))
+        bound = _parse_time_bound(value)
+        return FilterRule(text, negated, 'file', lambda path, size, mtime: mtime is not None and compare(mtime, bound))
+
+    # Plain glob: trailing '/' matches directories only, any other '/' anchors to the upload root
+    target = 'any'
+    if body.endswith('/'):
+        target = 'dir'
+        body = body.rstrip('/')
+    anchored = '/' in body
+    regex_body = _glob_to_regex(body.lstrip('/'))
+    try:
+        regex = re.compile(('^' if anchored else '^(?:.*/)?') + regex_body + '$')
+    except re.error as e:
+        raise ValueError(f"Invalid glob in rule '{text}': {e}")
+    return FilterRule(text, negated, target, lambda path, size, mtime: regex.match(path) is not None)
+
+class ScanFilter:
+    """Compiled include/exclude rules; the last matching rule wins, like .gitignore"""
+
+    def __init__(self, rules):
+        self.rules = [rule for rule in (_compile_filter_rule(line) for line in rules) if rule]
+        # Reversed so the first hit is the last matching rule
+        self._dir_rules = [r for r in reversed(self.rules) if r.target != 'file']
+        self._file_rules = [r for r in reversed(self.rules) if r.target != 'dir']
+
+    def __bool__(self):
+        return bool(self.rules)
+
+    def excludes_dir(self, rel_dir):
+        """Return True if the directory (posix path relative to the upload root) is pruned"""
+        for rule in self._dir_rules:
+            if rule.test(rel_dir, None, None):
+                return not rule.negated
+        return False
+
+    def excludes_file(self, rel_path, size=None, mtime=None):
+        """Return True if the file (posix path relative to the upload root) is excluded"""
+        for rule in self._file_rules:
+            if rule.test(rel_path, size, mtime):
+                return not rule.negated
+        return False
+
+def scan_folder(folder_path, scan_filter=None):
+    """Walk a folder into {subfolder: {'images': [...], 'documents': [...]}} applying scan filters"""
+    subfolder_map = {}
+    scan_stats = {'pruned_dirs': 0, 'excluded_files': 0, 'excluded_bytes': 0}
+
+    for root, dirs, files in os.walk(folder_path):
+        rel_root = os.path.relpath(root, folder_path)
+        if rel_root == '.':
+            rel_root = ''  # Root folder
+        posix_root = rel_root.replace(os.sep, '/')
+
+        # Prune excluded directories in place so os.walk never descends into them
+        if scan_filter:
+            kept_dirs = []
+            for dir_name in dirs:
+                rel_dir = f"{posix_root}/{dir_name}" if posix_root else dir_name
+                if scan_filter.excludes_dir(rel_dir):
+                    scan_stats['pruned_dirs'] += 1
+                    log_message("debug", f"Pruned directory: {rel_dir}")
+                else:
+                    kept_dirs.append(dir_name)
+            dirs[:] = kept_dirs
+
+        if rel_root not in subfolder_map:
+            subfolder_map[rel_root] = {'images': [], 'documents': []}
+
+        for file in files:
+            full_path = os.path.join(root, file)
+            try:
+                file_stat = os.stat(full_path)
+            except OSError:
+                continue
+            if not stat.S_ISREG(file_stat.st_mode):
+                continue
+
+            rel_path = os.path.relpath(full_path, folder_path)
+            if scan_filter and scan_filter.excludes_file(rel_path.replace(os.sep, '/'), file_stat.st_size, file_stat.st_mtime):
+                scan_stats['excluded_files'] += 1
+                scan_stats['excluded_bytes'] += file_stat.st_size
+                continue
+
+            ext = os.path.splitext(full_path)[1].lower()
+
+            if ext in IMAGE_EXTENSIONS:
+                subfolder_map[rel_root]['images'].append((full_path, rel_path))
+            else:
+                subfolder_map[rel_root]['documents'].append((full_path, rel_path))
+
+    return subfolder_map, scan_stats
+
+def parse_upload_args(args):
+    """Split /upload arguments into the folder path and per-call options"""
+    path_parts = []
+    options = {'filter_rules': [], 'profile': False}
+
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        flag, _, inline_value = arg.partition('=')
+        if flag in ('--exclude', '--include'):
+            if inline_value:
+                value = inline_value
+            elif i + 1 < len(args):
+                i += 1
+                value = args[i]
+            else:
+                raise ValueError(f"{flag} needs a rule")
+            options['filter_rules'].append(value if flag == '--exclude' else f"!{value}")
+        elif arg == '--profile':
+            options['profile'] = True
+        else:
+            path_parts.append(arg)
+        i += 1
+
+    return " ".join(path_parts), options
+
+@lru_cache(maxsize=None)
+def _dct_matrix(size):
+    """Orthonormal DCT-II basis used by the pHash"""
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2.0 / size)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+def compute_image_hash(source, method='dhash'):
+    """Return a 64-bit perceptual hash of an image path or bytes, or None if it cannot be decoded (runs in worker processes)"""
+    try:
+        with Image.open(io.BytesIO(source) if isinstance(source, bytes) else source) as img:
+            img.draft('L', (64, 64))  # Let JPEG decode at reduced scale
+            gray = img.convert('L')
+            if method == 'phash':
+                pixels = np.asarray(gray.resize((32, 32), Image.LANCZOS), dtype=np.float64)
+                dct = _dct_matrix(32)
+                low = (dct @ pixels @ dct.T)[:8, :8].ravel()
+                bits = low > np.median(low[1:])
+            else:
+                pixels = np.asarray(gray.resize((9, 8), Image.LANCZOS), dtype=np.int16)
+                bits = (pixels[:, 1:] > pixels[:, :-1]).ravel()
+    except Exception:
+        return None
+    return int(np.packbits(bits).view('>u8')[0])
+
+class ImageHashIndex:
+    """Growable NumPy array of 64-bit image hashes with vectorized Hamming distance search"""
+
+    def __init__(self, capacity=1024):
+        self._hashes = np.empty(capacity, dtype=np.uint64)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def add(self, value):
+        if self.size == len(self._hashes):
+            grown = np.empty(len(self._hashes) * 2, dtype=np.uint64)
+            grown[:self.size] = self._hashes[:self.size]
+            self._hashes = grown
+        self._hashes[self.size] = value
+        self.size += 1
+
+    def min_distances(self, values):
+        """Smallest Hamming distance from each value to any stored hash (65 where the index is empty)"""
+        values = np.asarray(values, dtype=np.uint64)
+        result = np.full(len(values), 65, dtype=np.int64)
+        if not self.size or not len(values):
+            return result
+        stored = self._hashes[:self.size]
+        # Compare a block of values at once, keeping the XOR matrix around 4M entries
+        step = max(1, (1 << 22) // self.size)
+        for start in range(0, len(values), step):
+            xor = np.bitwise_xor(values[start:start + step, None], stored[None, :])
+            if hasattr(np, 'bitwise_count'):
+                distances = np.bitwise_count(xor)
+            else:
+                distances = np.unpackbits(xor.view(np.uint8), axis=-1).reshape(xor.shape[0], -1, 64).sum(axis=2)
+            result[start:start + step] = distances.min(axis=1)
+        return result
+
+_hash_pool = None
+
+def get_hash_pool():
+    """Lazily start the process pool used for perceptual hashing"""
+    global _hash_pool
+    if _hash_pool is None:
+        # Spawn rather than fork: the bot process already runs threads (to_thread workers, profiler, HTTP client)
+        _hash_pool = ProcessPoolExecutor(max_workers=NEAR_DUP_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+    return _hash_pool
+
+async def shutdown_hash_pool(app: Application):
+    """Stop the hashing workers when the application shuts down"""
+    global _hash_pool
+    if _hash_pool is not None:
+        _hash_pool.shutdown(wait=False, cancel_futures=True)
+        _hash_pool = None
+
+async def filter_near_duplicates(context: ContextTypes.DEFAULT_TYPE, image_files: list):
+    """Drop images whose hash is within the chat's similarity threshold of one already sent or queued"""
+    similarity = context.chat_data.get('near_dup_similarity', NEAR_DUP_SIMILARITY)
+    max_distance = int(64 * (100 - similarity) / 100)
+    sent_index = context.chat_data.setdefault('image_hash_index', ImageHashIndex())
+    
+    pool = get_hash_pool()
+    hash_image = partial(compute_image_hash, method=NEAR_DUP_HASH)
+    window = NEAR_DUP_CHUNK_SIZE * (NEAR_DUP_WORKERS or os.cpu_count() or 1)
+    
+    def hash_window(sources):
+        # Archive members cannot cross the process boundary, so their bytes are sent instead;
+        # members over MAX_FILE_SIZE are never uploaded, so they are not read either
+        inputs = []
+        for source in sources:
+            if isinstance(source, ArchiveMember):
+                if source.size > MAX_FILE_SIZE:
+                    inputs.append(None)
+                    continue
+                with source.open() as member:
+                    inputs.append(member.read())
+            else:
+                inputs.append(source)
+        hashable = [value for value in inputs if value is not None]
+        hashed = iter(pool.map(hash_image, hashable, chunksize=NEAR_DUP_CHUNK_SIZE))
+        return [None if value is None else next(hashed) for value in inputs]
+    
+    # Hash in windows capped by count and by member bytes so memory held at once stays bounded
+    windows = []
+    current, current_bytes = [], 0
+    for file_path, _ in image_files:
+        member_bytes = file_path.size if isinstance(file_path, ArchiveMember) and file_path.size <= MAX_FILE_SIZE else 0
+        if current and (len(current) >= window or current_bytes + member_bytes > NEAR_DUP_WINDOW_BYTES):
+            windows.append(current)
+            current, current_bytes = [], 0
+        current.append(file_path)
+        current_bytes += member_bytes
+    if current:
+        windows.append(current)
+    
+    hash_values = []
+    for sources in windows:
+        hash_values.extend(await asyncio.to_thread(hash_window, sources))
+    
+    def nearest_distances(values):
+        # One vectorized pass against the sent index; only the in-batch check has to be sequential
+        hashed = [value for value in values if value is not None]
+        sent_distances = iter(sent_index.min_distances(hashed).tolist())
+        queued_index = ImageHashIndex(capacity=max(len(hashed), 1))
+        nearest = []
+        for value in values:
+            if value is None:
+                nearest.append(None)
+                continue
+            distance = min(next(sent_distances), int(queued_index.min_distances([value])[0]))
+            if distance > max_distance:
+                queued_index.add(value)
+            nearest.append(distance)
+        return nearest
+    
+    nearest = await asyncio.to_thread(nearest_distances, hash_values)
+    
+    kept = []
+    image_hashes = {}
+    for (file_path, rel_path), value, distance in zip(image_files, hash_values, nearest):
+        if distance is not None and distance <= max_distance:
+            log_message("info", f"  ⊘ Skipped (near-duplicate, {100 * (64 - distance) / 64:.0f}% similar): {rel_path}")
+            update_stats('skipped')
+            continue
+        
+        if value is not None:
+            image_hashes[file_path] = value
+        kept.append((file_path, rel_path))
+    
+    return kept, image_hashes
+
+def remember_image_hashes(context: ContextTypes.DEFAULT_TYPE, image_hashes: dict, file_paths: list):
+    """Record hashes of successfully sent images in the chat's index"""
+    if not image_hashes:
+        return
+    sent_index = context.chat_data.setdefault('image_hash_index', ImageHashIndex())
+    for file_path in file_paths:
+        if file_path in image_hashes:
+            sent_index.add(image_hashes[file_path])
+
+class _RecordCollector(logging.Handler):
+    """Collect formatted log records into a list"""
+
+    def __init__(self, sink):
+        super().__init__(logging.WARNING)
+        self.sink = sink
+
+    def emit(self, record):
+        self.sink.append(record.getMessage())
+
+class UploadProfiler:
+    """cProfile, a stack sampler and event loop stall tracking around one upload job"""
+
+    def __init__(self):
+        self.profile = cProfile.Profile()
+        self.stack_counts = Counter()
+        self.samples = 0
+        self.idle_samples = 0
+        self.stalls = []
+        self.max_lag = 0.0
+        self.max_tasks = 0
+        self.elapsed = 0.0
+        self._stop_event = threading.Event()
+        self._sampler = None
+        self._monitor = None
+        self._collector = None
+        self._loop = None
+        self._loop_debug = False
+        self._slow_callback_duration = None
+        self._started = 0.0
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        
+        if PROFILE_ASYNCIO_DEBUG:
+            # asyncio logs "Executing <Handle ...> took N seconds" for each slow callback
+            self._loop_debug = self._loop.get_debug()
+            self._slow_callback_duration = self._loop.slow_callback_duration
+            self._loop.slow_callback_duration = PROFILE_SLOW_CALLBACK
+            self._loop.set_debug(True)
+            self._collector = _RecordCollector(self.stalls)
+            logging.getLogger('asyncio').addHandler(self._collector)
+        
+        self._sampler = threading.Thread(
+            target=self._sample, args=(threading.get_ident(),), name="upload-profiler", daemon=True
+        )
+        self._sampler.start()
+        self._monitor = self._loop.create_task(self._watch_loop())
+        self._started = time.perf_counter()
+        
+        try:
+            self.profile.enable()
+        except ValueError as e:
+            # Another profiler (e.g. a debugger) already owns the interpreter hook
+            log_message("warning", f"cProfile unavailable, sampling only: {str(e)}")
+            self.profile = None
+
+    def stop(self):
+        if self.profile:
+            self.profile.disable()
+        self.elapsed = time.perf_counter() - self._started
+        self._stop_event.set()
+        self._sampler.join()
+        self._monitor.cancel()
+        
+        if self._collector:
+            logging.getLogger('asyncio').removeHandler(self._collector)
+            self._loop.set_debug(self._loop_debug)
+            self._loop.slow_callback_duration = self._slow_callback_duration
+
+    def _sample(self, thread_id):
+        """Sample the event loop thread's Python stack into collapsed-stack counts"""
+        while not self._stop_event.wait(PROFILE_SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if not stack:
+                continue
+            self.samples += 1
+            # The loop waits in selectors.select while awaiting network I/O or sleeps
+            if stack[0].startswith('select (selectors.py'):
+                self.idle_samples += 1
+            self.stack_counts[';'.join(reversed(stack))] += 1
+
+    async def _watch_loop(self):
+        """Measure event loop lag and peak task count with a cheap heartbeat"""
+        interval = PROFILE_SLOW_CALLBACK / 2
+        while True:
+            before = self._loop.time()
+            await asyncio.sleep(interval)
+            lag = self._loop.time() - before - interval
+            self.max_lag = max(self.max_lag, lag)
+            self.max_tasks = max(self.max_tasks, len(asyncio.all_tasks(self._loop)))
+            if lag >= PROFILE_SLOW_CALLBACK:
+                self.stalls.append(f"{datetime.now().strftime(LOG_TIME_FORMAT)} event loop blocked for ~{lag * 1000:.0f}ms")
+
+    def write_reports(self, out_dir, job_id):
+        """Write .prof, .collapsed and summary files, return their paths"""
+        paths = []
+        
+        if self.profile:
+            prof_path = os.path.join(out_dir, f"profile_{job_id}.prof")
+            self.profile.dump_stats(prof_path)
+            paths.append(prof_path)
+        
+        # Jobs shorter than one sample interval have no stacks; Telegram rejects empty files
+        if self.stack_counts:
+            collapsed_path = os.path.join(out_dir, f"profile_{job_id}.collapsed")
+            with open(collapsed_path, 'w', encoding='utf-8') as out:
+                for stack, count in self.stack_counts.most_common():
+                    out.write(f"{stack} {count}\n")
+            paths.append(collapsed_path)
+        
+        summary_path = os.path.join(out_dir, f"profile_{job_id}_summary.txt")
+        with open(summary_path, 'w', encoding='utf-8') as out:
+            out.write(f"Job: {job_id}\n")
+            out.write(f"Wall time: {self.elapsed:.2f}s\n")
+            out.write(f"Samples: {self.samples} (every {PROFILE_SAMPLE_INTERVAL * 1000:.0f}ms)\n")
+            out.write(f"Event loop idle (I/O or sleep): {self.idle_pct:.1f}%\n")
+            out.write(f"Max event loop lag: {self.max_lag * 1000:.0f}ms\n")
+            out.write(f"Peak asyncio tasks: {self.max_tasks}\n\n")
+            out.write(f"Slow callbacks / stalls ({len(self.stalls)}):\n")
+            for stall in self.stalls:
+                out.write(f"  {stall}\n")
+            if self.profile:
+                out.write("\nTop functions by cumulative time:\n")
+                stats = pstats.Stats(self.profile, stream=out)
+                stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(40)
+        paths.append(summary_path)
+        
+        return paths
+
+    @property
+    def idle_pct(self):
+        return 100.0 * self.idle_samples / self.samples if self.samples else 0.0
+
+def is_archive_path(path):
+    """True if the path names a supported zip/tar archive"""
+    return path.lower().endswith(ARCHIVE_EXTENSIONS)
+
+class _ZstdTarReader(io.RawIOBase):
+    """Seekable reader over a .zst stream for tarfile; backward seeks restart decompression"""
+
+    def __init__(self, path):
+        super().__init__()
+        self._path = path
+        self.name = path
+        self._raw = None
+        self._reopen()
+
+    def _reopen(self):
+        if self._raw:
+            self._raw.close()
+        self._raw = open(self._path, 'rb')
+        self._stream = zstandard.ZstdDecompressor().stream_reader(self._raw)
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def _read(self, size):
+        # Corrupt input surfaces as OSError, like the gzip/bz2/lzma readers tarfile uses
+        try:
+            return self._stream.read(size)
+        except zstandard.ZstdError as e:
+            raise OSError(f"Invalid zstd data: {e}") from e
+
+    def readinto(self, buffer):
+        data = self._read(len(buffer))
+        buffer[:len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            raise io.UnsupportedOperation("zstd streams cannot seek from the end")
+        if offset < self._pos:
+            self._reopen()
+        while self._pos < offset:
+            chunk = self._read(min(offset - self._pos, 1024 * 1024))
+            if not chunk:
+                break
+            self._pos += len(chunk)
+        return self._pos
+
+    def close(self):
+        if self._raw:
+            self._raw.close()
+        super().close()
+
+class ArchiveMember:
+    """A regular file inside an open Archive, read straight from the archive when uploaded"""
+
+    def __init__(self, archive, info, name, size, mtime):
+        self.archive = archive
+        self.info = info
+        self.name = name
+        self.size = size
+        self.mtime = mtime
+
+    def open(self):
+        return self.archive.open_member(self.info)
+
+    def __repr__(self):
+        return f"{self.archive.path}!{self.name}"
+
+class Archive:
+    """Read-only zip/tar archive whose members are listed as a virtual folder tree"""
+
+    def __init__(self, path):
+        self.path = path
+        self._zip = None
+        self._tar = None
+        self._zstd_reader = None
+        self._read_lock = threading.Lock()
+        
+        lower = path.lower()
+        if lower.endswith('.zip'):
+            self._zip = zipfile.ZipFile(path)
+        elif lower.endswith(('.tar.zst', '.tzst')):
+            if zstandard is None:
+                raise ValueError("Reading .tar.zst archives needs the zstandard package: pip install zstandard")
+            self._zstd_reader = _ZstdTarReader(path)
+            self._tar = tarfile.open(fileobj=self._zstd_reader, mode='r:')
+        else:
+            self._tar = tarfile.open(path, mode='r:*')
+
+    @property
+    def is_compressed_tar(self):
+        """Compressed tars can only seek backwards by decompressing again from the start"""
+        return self._tar is not None and not self.path.lower().endswith('.tar')
+
+    @property
+    def display_name(self):
+        """Archive file name without its archive extension"""
+        base = os.path.basename(self.path)
+        for ext in sorted(ARCHIVE_EXTENSIONS, key=len, reverse=True):
+            if base.lower().endswith(ext):
+                return base[:-len(ext)]
+        return base
+
+    @staticmethod
+    def _zip_mtime(info):
+        """Timestamp of a zip entry, or None when its DOS date is zeroed/invalid"""
+        try:
+            return datetime(*info.date_time).timestamp()
+        except (ValueError, OverflowError):
+            return None
+
+    def _iter_members(self):
+        """Yield (info, posix name, size, mtime) for every regular file"""
+        if self._zip:
+            for info in self._zip.infolist():
+                if not info.is_dir():
+                    yield info, info.filename, info.file_size, self._zip_mtime(info)
+        else:
+            for info in self._tar.getmembers():
+                if info.isfile():
+                    yield info, info.name, info.size, info.mtime
+
+    def open_member(self, info):
+        """Open a member for reading; call it off the event loop, as compressed tars are read here in full"""
+        if self._zip:
+            return self._zip.open(info)
+        if self.is_compressed_tar:
+            # httpx reads upload bodies on the event loop, so decompress the member up front into a
+            # buffer bounded by MAX_FILE_SIZE (larger members are skipped, never opened); retries
+            # then rewind the buffer instead of seeking the tar back through its compressed stream
+            with self._read_lock, self._tar.extractfile(info) as member:
+                return io.BytesIO(member.read())
+        return self._tar.extractfile(info)
+
+    def scan(self, scan_filter=None):
+        """Build the same subfolder map as scan_folder from the archive's member list"""
+        subfolder_map = {'': {'images': [], 'documents': []}}
+        scan_stats = {'pruned_dirs': 0, 'excluded_files': 0, 'excluded_bytes': 0}
+        dir_excluded = {'': False}
+        
+        for info, name, size, mtime in self._iter_members():
+            parts = [part for part in name.replace('\\', '/').split('/') if part and part != '.']
+            # Same path security as folders: never accept members that climb out of the root
+            if not parts or '..' in parts:
+                log_message("warning", f"  ⊘ Skipped (unsafe member path): {name}")
+                continue
+            
+            # Directories are implicit in member names, so prune by checking each ancestor once
+            excluded = False
+            for depth in range(1, len(parts)):
+                rel_dir = '/'.join(parts[:depth])
+                if rel_dir not in dir_excluded:
+                    dir_excluded[rel_dir] = dir_excluded['/'.join(parts[:depth - 1])] or bool(scan_filter and scan_filter.excludes_dir(rel_dir))
+                    if dir_excluded[rel_dir] and not dir_excluded['/'.join(parts[:depth - 1])]:
+                        scan_stats['pruned_dirs'] += 1
+                        log_message("debug", f"Pruned directory: {rel_dir}")
+                if dir_excluded[rel_dir]:
+                    excluded = True
+                    break
+            if excluded:
+                continue
+            
+            if scan_filter and scan_filter.excludes_file('/'.join(parts), size, mtime):
+                scan_stats['excluded_files'] += 1
+                scan_stats['excluded_bytes'] += size
+                continue
+            
+            rel_root = os.path.join(*parts[:-1]) if len(parts) > 1 else ''
+            rel_path = os.path.join(*parts)
+            member = ArchiveMember(self, info, rel_path, size, mtime)
+            
+            if rel_root not in subfolder_map:
+                subfolder_map[rel_root] = {'images': [], 'documents': []}
+            
+            ext = os.path.splitext(parts[-1])[1].lower()
+            if ext in IMAGE_EXTENSIONS:
+                subfolder_map[rel_root]['images'].append((member, rel_path))
+            else:
+                subfolder_map[rel_root]['documents'].append((member, rel_path))
+        
+        return subfolder_map, scan_stats
+
+    def close(self):
+        if self._zip:
+            self._zip.close()
+        if self._tar:
+            self._tar.close()
+        if self._zstd_reader:
+            self._zstd_reader.close()
+
+class MappedUploadSource(io.RawIOBase):
+    """Read-only view of a file backed by one mmap; every retry re-reads the same mapping from offset 0"""
+
+    def __init__(self, path):
+        super().__init__()
+        self.name = path
+        with open(path, 'rb') as file:
+            # The mapping keeps its own handle, so the file object can be closed right away
+            size = os.fstat(file.fileno()).st_size
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self._view = memoryview(self._map) if self._map else memoryview(b'')
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def read(self, size=-1):
+        end = len(self._view) if size is None or size < 0 else self._pos + size
+        data = self._view[self._pos:end].tobytes()
+        self._pos += len(data)
+        return data
+
+    def readall(self):
+        return self.read()
+
+    def readinto(self, buffer):
+        chunk = self._view[self._pos:self._pos + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._pos += len(chunk)
+        return len(chunk)
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._pos
+        elif whence == io.SEEK_END:
+            offset += len(self._view)
+        if offset < 0:
+            raise ValueError(f"Negative seek position {offset}")
+        self._pos = offset
+        return self._pos
+
+    def close(self):
+        if not self.closed:
+            self._view.release()
+            if self._map:
+                self._map.close()
+        super().close()
+
+def get_source_size(source):
+    """Size in bytes of a local file path or ArchiveMember"""
+    return source.size if isinstance(source, ArchiveMember) else os.path.getsize(source)
+
+def is_source_readable(source):
+    """Archive members are readable once the archive is open; files need read permission"""
+    return isinstance(source, ArchiveMember) or os.access(source, os.R_OK)
+
+def open_upload_source(source):
+    """Open a local file (memory-mapped) or ArchiveMember as a seekable binary stream (run via asyncio.to_thread)"""
+    return source.open() if isinstance(source, ArchiveMember) else MappedUploadSource(source)
+
+def source_filename(source):
+    """File name (without folders) of a local file path or ArchiveMember"""
+    return os.path.basename(source.name if isinstance(source, ArchiveMember) else source)
+
+def as_upload_input(stream, source, attach=False):
+    """Let httpx stream the upload in small chunks instead of PTB copying it into one bytes object per attempt"""
+    return InputFile(stream, filename=source_filename(source), attach=attach, read_file_handle=False)
+
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         "📁 <b>Multi-Step Uploader Bot v1.0</b>\n\n"
         "Send a folder path to start upload:\n"
-        "<code>/upload /path/to/your/folder</code>\n\n"
+        "<code>/upload /path/to/your/folder</code>\n"
+        "Archives work too (no extraction): <code>/upload /path/to/data.zip</code>\n\n"
         "Settings:\n"
         "<code>/topics on|off</code> - Create forum topic per subfolder (default: OFF)\n"
         "<code>/album on|off</code> - Album mode: group images into albums (default: ON)\n"
@@ -112,8 +1087,11 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "<code>/captions on|off</code> - Doc filename captions (default: ON)\n"
         "<code>/imagecaptions on|off</code> - Image folder name captions (default: OFF)\n"
         "<code>/logs on|off</code> - Enable/disable logging\n"
+        "<code>/filter add|remove|clear</code> - Include/exclude rules for scans\n"
+        "<code>/dedup on|off [similarity%]</code> - Skip near-duplicate images (default: OFF)\n"
+        "<code>/profile on|off</code> - Send profiler reports after uploads (default: OFF)\n"
         "Commands:\n"
-        "<code>/exportlog</code> - Export log file\n"
+        "<code>/exportlog [from=] [to=] [job=] [level=]</code> - Export log file (gzip)\n"
         "<code>/stats</code> - View upload statistics\n\n"
         "<b>⚠️ For topics to work:</b>\n"
         "1. Make bot admin with 'Manage Topics' permission\n"
@@ -275,6 +1253,109 @@ async def imagecaptions_command(update: Update, context: ContextTypes.DEFAULT_TY
         await update.message.reply_text("✅ Image captions disabled.")
         log_message("info", "=== Image captions disabled by user ===")
 
+async def filter_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Manage per-chat .gitignore-style include/exclude rules applied while scanning"""
+    rules = context.chat_data.setdefault('filter_rules', [])
+    action = context.args[0].lower() if context.args else ''
+    rule = " ".join(context.args[1:]).strip()
+    
+    if action == 'add' and rule:
+        try:
+            _compile_filter_rule(rule)
+        except ValueError as e:
+            await update.message.reply_text(f"❌ {str(e)}")
+            return
+        rules.append(rule)
+        await update.message.reply_text(f"✅ Filter rule added: <code>{html.escape(rule)}</code>", parse_mode=ParseMode.HTML)
+        log_message("info", f"=== Filter rule added by user: {rule} ===")
+    elif action == 'remove' and rule:
+        if rule not in rules:
+            await update.message.reply_text(f"❌ No such filter rule: <code>{html.escape(rule)}</code>", parse_mode=ParseMode.HTML)
+            return
+        rules.remove(rule)
+        await update.message.reply_text(f"✅ Filter rule removed: <code>{html.escape(rule)}</code>", parse_mode=ParseMode.HTML)
+        log_message("info", f"=== Filter rule removed by user: {rule} ===")
+    elif action == 'clear':
+        rules.clear()
+        await update.message.reply_text("✅ All filter rules cleared.")
+        log_message("info", "=== Filter rules cleared by user ===")
+    else:
+        active = DEFAULT_FILTER_RULES + rules
+        rule_lines = "\n".join(f"<code>{html.escape(r)}</code>" for r in active) if active else "<i>none</i>"
+        await update.message.reply_text(
+            f"🧹 <b>Filter rules</b> (last match wins)\n{rule_lines}\n\n"
+            f"Use: <code>/filter add node_modules/</code>, <code>/filter add !keep.tmp</code>, "
+            f"<code>/filter add re:\\.bak$</code>, <code>/filter add size&gt;50M</code>, "
+            f"<code>/filter add mtime&lt;2024-01-01</code> (modified before a date), "
+            f"<code>/filter add mtime&gt;30d</code> (older than 30 days), <code>/filter remove RULE</code>, <code>/filter clear</code>\n"
+            f"Per upload: <code>/upload /path --exclude *.tmp --include keep.tmp</code>",
+            parse_mode=ParseMode.HTML
+        )
+
+async def dedup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Toggle skipping of near-duplicate images (perceptual hash)"""
+    if not context.args or context.args[0].lower() not in ['on', 'off', 'reset']:
+        status = "enabled" if context.chat_data.get('near_dup_enabled', False) else "disabled"
+        similarity = context.chat_data.get('near_dup_similarity', NEAR_DUP_SIMILARITY)
+        index = context.chat_data.get('image_hash_index')
+        await update.message.reply_text(
+            f"Near-duplicate filter is currently <b>{status}</b> ({similarity}% similarity, "
+            f"{len(index) if index else 0} images indexed)\n\n"
+            f"Use: <code>/dedup on [similarity%]</code>, <code>/dedup off</code> or <code>/dedup reset</code> (forget sent images)",
+            parse_mode=ParseMode.HTML
+        )
+        return
+    
+    action = context.args[0].lower()
+    if action == 'on':
+        if not NEAR_DUP_AVAILABLE:
+            await update.message.reply_text("❌ Near-duplicate filter needs numpy and Pillow: pip install numpy pillow")
+            return
+        
+        if len(context.args) > 1:
+            try:
+                similarity = int(context.args[1].rstrip('%'))
+            except ValueError:
+                similarity = -1
+            if not 50 <= similarity <= 100:
+                await update.message.reply_text("❌ Similarity must be a percentage between 50 and 100.")
+                return
+            context.chat_data['near_dup_similarity'] = similarity
+        
+        context.chat_data['near_dup_enabled'] = True
+        similarity = context.chat_data.get('near_dup_similarity', NEAR_DUP_SIMILARITY)
+        await update.message.reply_text(f"✅ Near-duplicate filter enabled (images ≥{similarity}% similar to ones already sent are skipped).")
+        log_message("info", f"=== Near-duplicate filter enabled by user ({similarity}%) ===")
+    elif action == 'off':
+        context.chat_data['near_dup_enabled'] = False
+        await update.message.reply_text("✅ Near-duplicate filter disabled.")
+        log_message("info", "=== Near-duplicate filter disabled by user ===")
+    else:
+        context.chat_data.pop('image_hash_index', None)
+        await update.message.reply_text("✅ Sent-image index cleared.")
+        log_message("info", "=== Near-duplicate index reset by user ===")
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Toggle profiling of /upload jobs"""
+    if not context.args or context.args[0].lower() not in ['on', 'off']:
+        status = "enabled" if context.chat_data.get('profile_enabled', False) else "disabled"
+        await update.message.reply_text(
+            f"Upload profiling is currently <b>{status}</b>\n\n"
+            f"Use: <code>/profile on</code> (send .prof/.collapsed reports after each upload) or <code>/profile off</code>\n"
+            f"Single job: <code>/upload /path --profile</code>",
+            parse_mode=ParseMode.HTML
+        )
+        return
+    
+    if context.args[0].lower() == 'on':
+        context.chat_data['profile_enabled'] = True
+        await update.message.reply_text("✅ Profiling enabled (reports are sent after each upload).")
+        log_message("info", "=== Upload profiling enabled by user ===")
+    else:
+        context.chat_data['profile_enabled'] = False
+        await update.message.reply_text("✅ Profiling disabled.")
+        log_message("info", "=== Upload profiling disabled by user ===")
+
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show upload statistics"""
     stats_text = (
@@ -305,31 +1386,125 @@ async def logs_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         setup_logger()
         await update.message.reply_text("✅ Logging disabled. Only console output will be shown.")
 
+def parse_export_args(args):
+    """Parse /exportlog key=value filters into (start, end, job_id, min_level)"""
+    start = end = job_id = min_level = None
+    for arg in args:
+        key, sep, value = arg.partition('=')
+        key = key.lower()
+        if not sep or not value:
+            raise ValueError(f"Expected key=value, got: {arg}")
+        if key in ('from', 'since'):
+            start = datetime.fromtimestamp(_parse_time_bound(value)).strftime(LOG_TIME_FORMAT)
+        elif key in ('to', 'until'):
+            end = datetime.fromtimestamp(_parse_time_bound(value)).strftime(LOG_TIME_FORMAT)
+        elif key == 'job':
+            job_id = value
+        elif key == 'level':
+            min_level = logging.getLevelName(value.upper())
+            if not isinstance(min_level, int):
+                raise ValueError(f"Unknown log level: {value}")
+        else:
+            raise ValueError(f"Unknown filter: {key}")
+    return start, end, job_id, min_level
+
+def export_log_lines(out_path, start=None, end=None, job_id=None, min_level=None):
+    """Stream matching records from the log segments and live log into a gzip file, return the line count"""
+    sources = []
+    for segment in load_log_index():
+        if start and segment.get('end') and segment['end'] < start:
+            continue
+        if end and segment.get('start') and segment['start'] > end:
+            continue
+        if os.path.exists(segment['file']):
+            sources.append(segment['file'])
+    if os.path.exists(LOG_FILE_PATH):
+        sources.append(LOG_FILE_PATH)
+    
+    matched = 0
+    with gzip.open(out_path, 'wt', encoding='utf-8', compresslevel=6) as out:
+        for source in sources:
+            opener = gzip.open if source.endswith('.gz') else open
+            with opener(source, 'rt', encoding='utf-8', errors='replace') as log_file:
+                keep = False
+                for line in log_file:
+                    match = LOG_LINE_RE.match(line)
+                    if match:
+                        # Timestamps compare lexicographically; records are written in time order
+                        timestamp, level, line_job = match.group(1), match.group(2), match.group(3) or '-'
+                        if end and timestamp > end:
+                            break
+                        keep = (
+                            (not start or timestamp >= start)
+                            and (not job_id or line_job == job_id)
+                            and (min_level is None or logging.getLevelName(level) >= min_level)
+                        )
+                    # Continuation lines (tracebacks) follow the record they belong to
+                    if keep:
+                        out.write(line)
+                        matched += 1
+    return matched
+
 async def export_log_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Export log file to user"""
-    if not LOGGING_ENABLED or not os.path.exists(LOG_FILE_PATH):
+    """Export matching log records (gzip'd) to user"""
+    if not LOGGING_ENABLED or not (os.path.exists(LOG_FILE_PATH) or load_log_index()):
         await update.message.reply_text("❌ Logging is disabled or no log file exists.")
         return
     
     try:
-        with open(LOG_FILE_PATH, 'rb') as log_file:
+        start, end, job_id, min_level = parse_export_args(context.args or [])
+    except ValueError as e:
+        await update.message.reply_text(
+            f"❌ {html.escape(str(e))}\n\n"
+            f"Use: <code>/exportlog [from=2024-01-01|6h] [to=2024-01-02T12:00] [job=ID] [level=warning]</code>",
+            parse_mode=ParseMode.HTML
+        )
+        return
+    
+    fd, export_path = tempfile.mkstemp(suffix='.txt.gz')
+    os.close(fd)
+    try:
+        matched = await asyncio.to_thread(export_log_lines, export_path, start, end, job_id, min_level)
+        if matched == 0:
+            await update.message.reply_text("📭 No log lines match those filters.")
+            return
+        
+        export_size = os.path.getsize(export_path)
+        if export_size > MAX_FILE_SIZE:
+            await update.message.reply_text(
+                f"❌ Export is too large ({export_size / (1024 * 1024):.2f}MB). Narrow it with from=/to=/job=/level=."
+            )
+            return
+        
+        with open(export_path, 'rb') as log_file:
             await update.message.reply_document(
                 document=log_file,
-                filename=f"upload_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt",
-                caption=f"Upload log export"
+                filename=f"upload_log_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt.gz",
+                caption=f"Upload log export ({matched} lines)"
             )
     except Exception as e:
         await update.message.reply_text(f"❌ Error exporting log: {str(e)}")
+    finally:
+        try:
+            os.remove(export_path)
+        except OSError:
+            pass
 
 async def upload_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Main handler for /upload command"""
     if not context.args:
-        await update.message.reply_text("❌ Please provide a folder path: /upload /path/to/folder")
+        await update.message.reply_text("❌ Please provide a folder or archive path: /upload /path/to/folder (or .zip/.tar.gz)")
         return
     
-    folder_path = " ".join(context.args)
+    try:
+        folder_path, upload_options = parse_upload_args(context.args)
+        scan_filter = ScanFilter(DEFAULT_FILTER_RULES + context.chat_data.get('filter_rules', []) + upload_options['filter_rules'])
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {str(e)}")
+        return
     
-    if ".." in folder_path or not os.path.isdir(folder_path):
+    is_archive = os.path.isfile(folder_path) and is_archive_path(folder_path)
+    if ".." in folder_path or not (os.path.isdir(folder_path) or is_archive):
         await update.message.reply_text("❌ Invalid folder path!")
         return
     
@@ -337,7 +1512,96 @@ async def upload_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text(f"❌ Folder not found: {folder_path}")
         return
     
-    folder_name = os.path.basename(os.path.abspath(folder_path))
+    # Archives are read in place: members are streamed into the upload, never extracted to disk
+    archive = None
+    if is_archive:
+        try:
+            archive = await asyncio.to_thread(Archive, folder_path)
+        except (OSError, ValueError, zipfile.BadZipFile, tarfile.TarError) as e:
+            await update.message.reply_text(f"❌ Cannot open archive: {str(e)}")
+            return
+    
+    # Tag every log line of this job so /exportlog job=<id> can pull it out later
+    job_id = uuid4().hex[:8]
+    job_token = current_job_id.set(job_id)
+    
+    try:
+        if upload_options['profile'] or context.chat_data.get('profile_enabled', False):
+            await run_profiled_upload(update, context, job_id, folder_path, scan_filter, archive)
+        else:
+            await run_upload(update, context, job_id, folder_path, scan_filter, archive)
+    finally:
+        current_job_id.reset(job_token)
+        if archive:
+            archive.close()
+
+async def run_profiled_upload(update: Update, context: ContextTypes.DEFAULT_TYPE, job_id: str, folder_path: str, scan_filter: ScanFilter, archive: Archive = None):
+    """Run an upload under UploadProfiler and send the reports back to the chat"""
+    profiler = UploadProfiler()
+    log_message("info", f"⏱️ Profiling upload job {job_id}")
+    profiler.start()
+    try:
+        await run_upload(update, context, job_id, folder_path, scan_filter, archive)
+    finally:
+        profiler.stop()
+    
+    out_dir = tempfile.mkdtemp(prefix="msu_profile_")
+    open_files = []
+    try:
+        report_paths = await asyncio.to_thread(profiler.write_reports, out_dir, job_id)
+        caption = (
+            f"⏱️ <b>Profile</b> <code>{job_id}</code>\n"
+            f"Wall: {profiler.elapsed:.1f}s | Idle: {profiler.idle_pct:.0f}% | "
+            f"Max lag: {profiler.max_lag * 1000:.0f}ms | Stalls: {len(profiler.stalls)}"
+        )
+        for path in report_paths:
+            open_files.append(open(path, 'rb'))
+        
+        if len(open_files) == 1:
+            # A media group needs at least two items
+            await retry_with_backoff(
+                context.bot.send_document,
+                chat_id=update.effective_chat.id,
+                document=open_files[0],
+                filename=os.path.basename(report_paths[0]),
+                caption=caption,
+                parse_mode=ParseMode.HTML,
+                read_timeout=TIMEOUT_SECONDS,
+                write_timeout=TIMEOUT_SECONDS
+            )
+        else:
+            media_group = [
+                InputMediaDocument(media=file, filename=os.path.basename(path))
+                for file, path in zip(open_files, report_paths)
+            ]
+            media_group[-1] = InputMediaDocument(
+                media=media_group[-1].media,
+                filename=os.path.basename(report_paths[-1]),
+                caption=caption,
+                parse_mode=ParseMode.HTML
+            )
+            await retry_with_backoff(
+                context.bot.send_media_group,
+                chat_id=update.effective_chat.id,
+                media=media_group,
+                read_timeout=TIMEOUT_SECONDS,
+                write_timeout=TIMEOUT_SECONDS
+            )
+        log_message("success", f"✅ Profile for job {job_id} sent")
+    except Exception as e:
+        log_message("error", f"❌ Failed to send profile for job {job_id}: {str(e)}")
+        await update.message.reply_text(f"❌ Error sending profile: {str(e)}")
+    finally:
+        for f in open_files:
+            try:
+                f.close()
+            except Exception:
+                pass
+        shutil.rmtree(out_dir, ignore_errors=True)
+
+async def run_upload(update: Update, context: ContextTypes.DEFAULT_TYPE, job_id: str, folder_path: str, scan_filter: ScanFilter, archive: Archive = None):
+    """Scan a validated folder (or open archive) and upload it subfolder by subfolder"""
+    folder_name = archive.display_name if archive else os.path.basename(os.path.abspath(folder_path))
     reset_stats()
     
     # Check all preferences
@@ -347,10 +1611,11 @@ async def upload_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     album_captions = context.chat_data.get('album_captions_enabled', False)
     doc_captions = context.chat_data.get('captions_enabled', True)
     image_captions = context.chat_data.get('image_captions_enabled', False)
+    near_dup_enabled = NEAR_DUP_AVAILABLE and context.chat_data.get('near_dup_enabled', False)
     chat_id = update.effective_chat.id
     
     try:
-        log_message("info", f"📂 Starting upload for folder: {folder_name}")
+        log_message("info", f"📂 Starting upload for folder: {folder_name} (job {job_id})")
         log_message("info", f"📂 Full path: {folder_path}")
         log_message("info", f"📌 Topics mode: {topics_enabled}")
         log_message("info", f"📦 Album mode: {album_mode}")
@@ -358,6 +1623,8 @@ async def upload_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         log_message("info", f"🖼️ Album captions: {album_captions}")
         log_message("info", f"📝 Doc captions: {doc_captions}")
         log_message("info", f"🖼️ Image captions: {image_captions}")
+        log_message("info", f"🧹 Filter rules: {len(scan_filter.rules)}")
+        log_message("info", f"🧬 Near-duplicate filter: {near_dup_enabled}")
         
         # Get chat info for forum status
         chat = await context.bot.get_chat(chat_id)
@@ -370,33 +1637,20 @@ async def upload_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Main status message stays in the main chat
         title_msg = await update.message.reply_text(
             f"📂 <b>Uploading Folder:</b> <code>{folder_name}</code>\n"
+            f"🆔 Job: <code>{job_id}</code>\n"
             f"{status_line}\n"
             f"⏳ Scanning contents...",
             parse_mode=ParseMode.HTML
         )
         
-        # Build subfolder map
-        subfolder_map = {}
-        for root, dirs, files in os.walk(folder_path):
-            rel_root = os.path.relpath(root, folder_path)
-            if rel_root == '.':
-                rel_root = ''  # Root folder
-            
-            if rel_root not in subfolder_map:
-                subfolder_map[rel_root] = {'images': [], 'documents': []}
-            
-            for file in files:
-                full_path = os.path.join(root, file)
-                if not os.path.isfile(full_path):
-                    continue
-                
-                rel_path = os.path.relpath(full_path, folder_path)
-                ext = os.path.splitext(full_path)[1].lower()
-                
-                if ext in IMAGE_EXTENSIONS:
-                    subfolder_map[rel_root]['images'].append((full_path, rel_path))
-                else:
-                    subfolder_map[rel_root]['documents'].append((full_path, rel_path))
+        # Build subfolder map, pruning filtered directories and files during the walk
+        # Listing a compressed tar decompresses it end to end, so keep the walk off the event loop
+        if archive:
+            if archive.is_compressed_tar:
+                log_message("warning", "Compressed tar: subfolders follow archive order; going back to an earlier member re-decompresses from the start in a worker thread (use .zip or plain .tar for large archives)")
+            subfolder_map, scan_stats = await asyncio.to_thread(archive.scan, scan_filter)
+        else:
+            subfolder_map, scan_stats = await asyncio.to_thread(scan_folder, folder_path, scan_filter)
         
         total_files = sum(len(v['images']) + len(v['documents']) for v in subfolder_map.values())
         if total_files == 0:
@@ -406,11 +1660,24 @@ async def upload_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         log_message("info", f"📊 Found {total_files} total files in {len(subfolder_map)} subfolders")
         
+        filter_info = ""
+        if scan_stats['pruned_dirs'] or scan_stats['excluded_files']:
+            excluded_mb = scan_stats['excluded_bytes'] / (1024 * 1024)
+            filter_info = f"\n🧹 Filtered: {scan_stats['pruned_dirs']} folders pruned, {scan_stats['excluded_files']} files excluded ({excluded_mb:.2f}MB)"
+            log_message("info", f"🧹 Pruned {scan_stats['pruned_dirs']} folders, excluded {scan_stats['excluded_files']} files ({excluded_mb:.2f}MB)")
+        
         # Process each subfolder sequentially
         processed_folders = 0
         topics_created = 0
         
-        for subfolder, files_dict in sorted(subfolder_map.items()):
+        # Compressed tars can only be read forwards cheaply, so walk their subfolders in archive order
+        if archive and archive.is_compressed_tar:
+            subfolder_items = sorted(subfolder_map.items(), key=lambda item: min(
+                (member.info.offset for member, _ in item[1]['images'] + item[1]['documents']), default=0))
+        else:
+            subfolder_items = sorted(subfolder_map.items())
+        
+        for subfolder, files_dict in subfolder_items:
             if len(files_dict['images']) == 0 and len(files_dict['documents']) == 0:
                 continue
             
@@ -470,22 +1737,28 @@ async def upload_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             # Step 2: Upload pictures for this subfolder
             if files_dict['images']:
                 log_message("info", f"📂 Processing subfolder: {folder_display}")
-                log_message("info", f"🖼️ Uploading {len(files_dict['images'])} images")
+                
+                image_files = files_dict['images']
+                image_hashes = None
+                if near_dup_enabled:
+                    image_files, image_hashes = await filter_near_duplicates(context, image_files)
+                
+                log_message("info", f"🖼️ Uploading {len(image_files)} images")
                 
                 # Update main status message in the main chat (no message_thread_id)
                 await title_msg.edit_text(
                     f"📂 <b>{folder_name}</b>\n"
                     f"{status_line}\n"
                     f"🖼️ <b>Subfolder:</b> <code>{folder_display}</code> {'📌 (Topic)' if topic_id else ''}\n"
-                    f"📤 Uploading {len(files_dict['images'])} image(s)...",
+                    f"📤 Uploading {len(image_files)} image(s)...",
                     parse_mode=ParseMode.HTML,
                 )
                 
                 # Pass album_caption_folder instead of folder_display_full
                 if album_mode:
-                    await upload_media_groups(update, context, files_dict['images'], album_captions, album_caption_folder, topic_id)
+                    await upload_media_groups(update, context, image_files, album_captions, album_caption_folder, topic_id, image_hashes)
                 else:
-                    await upload_images_individual(update, context, files_dict['images'], image_captions, topic_id)
+                    await upload_images_individual(update, context, image_files, image_captions, topic_id, image_hashes)
                 
                 log_message("success", f"✅ Images complete for {folder_display}")
                 await asyncio.sleep(1)
@@ -521,7 +1794,8 @@ async def upload_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await title_msg.edit_text(
             f"✅ <b>Upload Complete!</b>\n\n"
             f"📂 <b>Folder:</b> {folder_name}\n"
-            f"{status_line}{topics_info}\n\n"
+            f"🆔 Job: <code>{job_id}</code>\n"
+            f"{status_line}{topics_info}{filter_info}\n\n"
             f"📊 <b>Stats:</b> {upload_stats['success']}/{total_files} files\n"
             f"❌ Failed: {upload_stats['failed']} | ⊘ Skipped: {upload_stats['skipped']}",
             parse_mode=ParseMode.HTML
@@ -533,13 +1807,13 @@ async def upload_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         log_message("error", f"❌ Fatal error: {str(e)}")
         await update.message.reply_text(f"❌ Error: {str(e)}")
 
-async def upload_images_individual(update: Update, context: ContextTypes.DEFAULT_TYPE, image_files: list, captions_enabled: bool, topic_id: int = None):
+async def upload_images_individual(update: Update, context: ContextTypes.DEFAULT_TYPE, image_files: list, captions_enabled: bool, topic_id: int = None, image_hashes: dict = None):
     """Upload images individually (album mode OFF)"""
     chat_id = update.effective_chat.id
     
     for idx, (file_path, rel_path) in enumerate(image_files, 1):
         try:
-            file_size = os.path.getsize(file_path)
+            file_size = get_source_size(file_path)
             file_size_mb = file_size / (1024 * 1024)
             
             if file_size > MAX_FILE_SIZE:
@@ -547,7 +1821,7 @@ async def upload_images_individual(update: Update, context: ContextTypes.DEFAULT
                 update_stats('skipped')
                 continue
             
-            if not os.access(file_path, os.R_OK):
+            if not is_source_readable(file_path):
                 log_message("warning", f"  ⊘ Skipped (not readable): {rel_path}")
                 update_stats('skipped')
                 continue
@@ -564,17 +1838,18 @@ async def upload_images_individual(update: Update, context: ContextTypes.DEFAULT
                 caption = f"<code>{folder_name_part}</code>"
                 parse_mode = ParseMode.HTML
             
-            with open(file_path, 'rb') as file:
+            with await asyncio.to_thread(open_upload_source, file_path) as file:
                 await retry_with_backoff(
                     context.bot.send_photo,
                     chat_id=chat_id,
                     message_thread_id=topic_id,
-                    photo=file,
+                    photo=as_upload_input(file, file_path),
                     caption=caption,
                     parse_mode=parse_mode
                 )
             
             update_stats('success')
+            remember_image_hashes(context, image_hashes, [file_path])
             log_message("info", f"  ✅ Uploaded: {rel_path}")
             
             # Dynamic delay based on file size
@@ -585,7 +1860,7 @@ async def upload_images_individual(update: Update, context: ContextTypes.DEFAULT
             log_message("error", f"  ❌ Failed after retries: {rel_path} - {str(e)}")
             update_stats('failed')
 
-async def upload_media_groups(update: Update, context: ContextTypes.DEFAULT_TYPE, image_files: list, album_captions_enabled: bool, folder_name: str, topic_id: int = None):
+async def upload_media_groups(update: Update, context: ContextTypes.DEFAULT_TYPE, image_files: list, album_captions_enabled: bool, folder_name: str, topic_id: int = None, image_hashes: dict = None):
     """Upload images in media groups (albums) of up to 10 photos each"""
     chat_id = update.effective_chat.id
     batch_size = 10
@@ -594,6 +1869,7 @@ async def upload_media_groups(update: Update, context: ContextTypes.DEFAULT_TYPE
         batch = image_files[i:i + batch_size]
         media_group = []
         open_files = []
+        queued_paths = []
         batch_num = i // batch_size + 1
         total_batches = (len(image_files) + batch_size - 1) // batch_size
         
@@ -602,7 +1878,7 @@ async def upload_media_groups(update: Update, context: ContextTypes.DEFAULT_TYPE
         try:
             # Build media group
             for idx, (file_path, rel_path) in enumerate(batch):
-                file_size = os.path.getsize(file_path)
+                file_size = get_source_size(file_path)
                 file_size_mb = file_size / (1024 * 1024)
                 
                 if file_size > MAX_FILE_SIZE:
@@ -610,23 +1886,24 @@ async def upload_media_groups(update: Update, context: ContextTypes.DEFAULT_TYPE
                     update_stats('skipped')
                     continue
                 
-                if not os.access(file_path, os.R_OK):
+                if not is_source_readable(file_path):
                     log_message("warning", f"    ⊘ Skipped (not readable): {rel_path}")
                     update_stats('skipped')
                     continue
                 
-                file = open(file_path, 'rb')
+                file = await asyncio.to_thread(open_upload_source, file_path)
                 open_files.append(file)
+                queued_paths.append(file_path)
                 
                 # Use folder_name parameter which now contains just the folder name
                 if album_captions_enabled and idx == 0:
                     media_group.append(InputMediaPhoto(
-                        media=file,
+                        media=as_upload_input(file, file_path, attach=True),
                         caption=f"<code>{folder_name}</code>",
                         parse_mode=ParseMode.HTML
                     ))
                 else:
-                    media_group.append(InputMediaPhoto(media=file))
+                    media_group.append(InputMediaPhoto(media=as_upload_input(file, file_path, attach=True)))
                 
                 log_message("info", f"    📤 Queued: {rel_path} ({file_size_mb:.2f}MB)")
             
@@ -641,6 +1918,7 @@ async def upload_media_groups(update: Update, context: ContextTypes.DEFAULT_TYPE
                     write_timeout=TIMEOUT_SECONDS
                 )
                 update_stats('success')
+                remember_image_hashes(context, image_hashes, queued_paths)
                 log_message("info", f"    ✅ Batch {batch_num} uploaded")
                 
                 # Dynamic rate limiting
@@ -673,7 +1951,7 @@ async def upload_document_groups(update: Update, context: ContextTypes.DEFAULT_T
         try:
             # Build media group
             for idx, (file_path, rel_path) in enumerate(batch):
-                file_size = os.path.getsize(file_path)
+                file_size = get_source_size(file_path)
                 file_size_mb = file_size / (1024 * 1024)
                 
                 if file_size > MAX_FILE_SIZE:
@@ -681,22 +1959,22 @@ async def upload_document_groups(update: Update, context: ContextTypes.DEFAULT_T
                     update_stats('skipped')
                     continue
                 
-                if not os.access(file_path, os.R_OK):
+                if not is_source_readable(file_path):
                     log_message("warning", f"    ⊘ Skipped (not readable): {rel_path}")
                     update_stats('skipped')
                     continue
                 
-                file = open(file_path, 'rb')
+                file = await asyncio.to_thread(open_upload_source, file_path)
                 open_files.append(file)
                 
                 # Prepare caption (filename only)
-                filename_only = os.path.basename(file_path)
+                filename_only = source_filename(file_path)
                 caption = f"<code>{filename_only}</code>" if captions_enabled else None
                 
                 # Add to media group
                 media_group.append(
                     InputMediaDocument(
-                        media=file,
+                        media=as_upload_input(file, file_path, attach=True),
                         filename=filename_only,
                         caption=caption,
                         parse_mode=ParseMode.HTML if captions_enabled else None
@@ -737,7 +2015,7 @@ async def upload_documents(update: Update, context: ContextTypes.DEFAULT_TYPE, d
     
     for idx, (file_path, rel_path) in enumerate(doc_files, 1):
         try:
-            file_size = os.path.getsize(file_path)
+            file_size = get_source_size(file_path)
             file_size_mb = file_size / (1024 * 1024)
             
             if file_size > MAX_FILE_SIZE:
@@ -745,16 +2023,16 @@ async def upload_documents(update: Update, context: ContextTypes.DEFAULT_TYPE, d
                 update_stats('skipped')
                 continue
             
-            if not os.access(file_path, os.R_OK):
+            if not is_source_readable(file_path):
                 log_message("warning", f"  ⊘ Skipped (not readable): {rel_path}")
                 update_stats('skipped')
                 continue
             
             log_message("info", f"  📄 [{idx}/{len(doc_files)}] Uploading: {rel_path} ({file_size_mb:.2f}MB)")
             
-            with open(file_path, 'rb') as file:
+            with await asyncio.to_thread(open_upload_source, file_path) as file:
                 # Caption shows only filename, not folder path
-                filename_only = os.path.basename(file_path)
+                filename_only = source_filename(file_path)
                 caption = f"<code>{filename_only}</code>" if captions_enabled else None
                 parse_mode = ParseMode.HTML if captions_enabled else None
                 
@@ -762,7 +2040,7 @@ async def upload_documents(update: Update, context: ContextTypes.DEFAULT_TYPE, d
                     context.bot.send_document,
                     chat_id=chat_id,
                     message_thread_id=topic_id,
-                    document=file,
+                    document=as_upload_input(file, file_path),
                     filename=filename_only,
                     caption=caption,
                     parse_mode=parse_mode
@@ -791,6 +2069,21 @@ def main():
     print("="*60 + "\n")
     
     logger = setup_logger()
+    
+    if WEBHOOK_ENABLED:
+        # Telegram only delivers to a public https URL, and without a secret token anyone
+        # who can reach the port could post forged updates
+        webhook_errors = []
+        if not WEBHOOK_URL.lower().startswith("https://"):
+            webhook_errors.append("WEBHOOK_URL must be set to the public https URL of the webhook")
+        if not re.fullmatch(r'[A-Za-z0-9_-]{1,256}', WEBHOOK_SECRET_TOKEN):
+            webhook_errors.append("WEBHOOK_SECRET_TOKEN must be 1-256 characters of A-Z, a-z, 0-9, _ or -")
+        if webhook_errors:
+            for error in webhook_errors:
+                log_message("error", f"Webhook mode: {error}")
+                print(f"❌ Webhook mode: {error}")
+            return
+    
     log_message("info", "=== Bot Started ===")
     
     print("Configuration:")
@@ -800,9 +2093,10 @@ def main():
     print(f"  • Max retries: {MAX_RETRIES}")
     print(f"  • Timeout: {TIMEOUT_SECONDS}s")
     print(f"  • Rate limit delay: {RATE_LIMIT_DELAY}s")
+    print(f"  • Update mode: {f'webhook on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}{WEBHOOK_PATH}' if WEBHOOK_ENABLED else 'polling'}")
     print("\nBot is running! Press Ctrl+C to stop\n")
     
-    app = Application.builder().token(BOT_TOKEN).build()
+    app = Application.builder().token(BOT_TOKEN).post_shutdown(shutdown_hash_pool).build()
     app.add_handler(CommandHandler("start", start_command))
     app.add_handler(CommandHandler("stats", stats_command))
     app.add_handler(CommandHandler("upload", upload_command))
@@ -814,10 +2108,26 @@ def main():
     app.add_handler(CommandHandler("imagecaptions", imagecaptions_command))
     app.add_handler(CommandHandler("logs", logs_command))
     app.add_handler(CommandHandler("exportlog", export_log_command))
+    app.add_handler(CommandHandler("filter", filter_command))
+    app.add_handler(CommandHandler("profile", profile_command))
+    app.add_handler(CommandHandler("dedup", dedup_command))
     
     print("Bot is running! Send /upload <folder_path> to test")
-    print("Settings: /topics, /album, /docgroup, /albumcaptions, /captions, /imagecaptions, /logs")
-    app.run_polling()
+    print("Settings: /topics, /album, /docgroup, /albumcaptions, /captions, /imagecaptions, /logs, /filter, /profile, /dedup")
+    if WEBHOOK_ENABLED:
+        # Needs the webhooks extra: pip install "python-telegram-bot[webhooks]"
+        app.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH.lstrip('/'),
+            secret_token=WEBHOOK_SECRET_TOKEN,
+            cert=WEBHOOK_TLS_CERT or None,
+            key=WEBHOOK_TLS_KEY or None,
+            webhook_url=WEBHOOK_URL,
+            allowed_updates=Update.ALL_TYPES
+        )
+    else:
+        app.run_polling()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file